@@ -1,14 +1,19 @@
+import os
+
+# Use the compiled upb protobuf backend; must be set before protobuf is imported
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
 import aiohttp
 import asyncio
 from google.transit import gtfs_realtime_pb2
-import redis
-import json
+import redis.asyncio as redis
+import orjson
 import time
 
 class BusDataIngester:
-    def __init__(self, feed_url, redis_client):
+    def __init__(self, feed_url, redis_client: redis.Redis):
         self.feed_url = feed_url  # Your city's bus data URL
-        self.redis = redis_client
+        self.redis = redis_client  # async client; never block the event loop
     
     async def fetch_bus_data(self):
         """Get bus data from the city's system"""
@@ -22,6 +27,7 @@ class BusDataIngester:
         feed.ParseFromString(raw_data)
         
         buses = []
+        pipe = self.redis.pipeline(transaction=False)
         for entity in feed.entity:
             if entity.HasField('vehicle'):
                 v = entity.vehicle
@@ -35,7 +41,8 @@ class BusDataIngester:
                 }
                 buses.append(bus_info)
                 
-                # Save to Redis
-                self.redis.set(f"bus:{bus_info['id']}", json.dumps(bus_info))
+                # Queue the Redis write; flushed in one round-trip below
+                pipe.set(f"bus:{bus_info['id']}", orjson.dumps(bus_info))
         
+        await pipe.execute()
         return buses
@@ -12,6 +12,50 @@ type Bus = {
   is_ghost: boolean;
 };
 
+// Bus record as sent by the backend over /ws
+type BusRecord = {
+  vehicle_id: string;
+  route_id: string | null;
+  lat: number;
+  lon: number;
+  is_ghost?: boolean;
+};
+
+type BusPing = { id: string; ts: number };
+
+type ServerMessage =
+  | { type: 'snapshot'; data: BusRecord[] }
+  | { type: 'bus.batch'; data: BusRecord[]; pings: BusPing[] }
+  | { type: 'bus.update'; data: BusRecord }
+  | ({ type: 'bus.ping' } & BusPing);
+
+const toBus = (record: BusRecord): Bus => ({
+  id: record.vehicle_id,
+  route: record.route_id ?? '',
+  lat: record.lat,
+  lon: record.lon,
+  is_ghost: record.is_ghost ?? false,
+});
+
+function applyMessage(buses: Map<string, Bus>, message: ServerMessage) {
+  switch (message.type) {
+    case 'snapshot':
+      buses.clear();
+      message.data.forEach(record => buses.set(record.vehicle_id, toBus(record)));
+      break;
+    case 'bus.batch':
+      // Pinged buses are unchanged; only the re-checked ones carry records
+      message.data.forEach(record => buses.set(record.vehicle_id, toBus(record)));
+      break;
+    case 'bus.update':
+      buses.set(message.data.vehicle_id, toBus(message.data));
+      break;
+    case 'bus.ping':
+      // Position and ghost status are unchanged
+      break;
+  }
+}
+
 const realBusIcon = new L.Icon({
   iconUrl: 'https://chart.googleapis.com/chart?chst=d_map_pin_letter&chld=R|00FF00|000000',
   iconSize: [21, 34],
@@ -41,10 +85,18 @@ function App() {
 
   useEffect(() => {
     const ws = new WebSocket('ws://localhost:8000/ws');
+    // The backend sends UTF-8 JSON as binary frames
+    ws.binaryType = 'arraybuffer';
+    const decoder = new TextDecoder();
+    const latest = new Map<string, Bus>();
 
     ws.onmessage = (event) => {
-      const busData = JSON.parse(event.data);
-      setBuses(busData);
+      const text = typeof event.data === 'string' ? event.data : decoder.decode(event.data);
+      const parsed = JSON.parse(text);
+      // A client that fell behind gets its backlog merged into one array
+      const messages: ServerMessage[] = Array.isArray(parsed) ? parsed : [parsed];
+      messages.forEach(message => applyMessage(latest, message));
+      setBuses(Array.from(latest.values()));
     };
 
     return () => ws.close();